@@ -1,22 +1,31 @@
 import os
 import psycopg2
 import psycopg2.extras
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import Flask, render_template, request, redirect, url_for, session, flash, stream_with_context
 from werkzeug.utils import secure_filename
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.security import generate_password_hash, check_password_hash
 import secrets
 import uuid
+import time
 from datetime import datetime, timedelta
 import urllib
 from flask_wtf.csrf import CSRFProtect
+import httpx
+from postgrest.exceptions import APIError
 from create_db import migrate
 
-from supabase_client import supabase
+from supabase_client import supabase, replicas
+from events import log_event, LISTING_IMPRESSION, LISTING_VIEW, SERVICE_REQUEST, REVIEW_SUBMIT
+from compression import Compress
+from rate_limit import RateLimiter, Limit, by_ip_and_provider, by_phone
 from dotenv import load_dotenv
 
 
 load_dotenv()
 csrf = CSRFProtect()
+compress = Compress()
+limiter = RateLimiter()
 
 #Run migrations on startup
 #migrate()
@@ -25,7 +34,14 @@ csrf = CSRFProtect()
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", "dev_secret")
 
+# Reverse proxies in front of gunicorn (1 for the PaaS router); 0 trusts no X-Forwarded-* headers
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", 1))
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS)
+
 csrf.init_app(app)
+compress.init_app(app)
+limiter.init_app(app)
 # =========================
 # REVIEW TOKENS
 # =========================
@@ -59,6 +75,57 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 DATABASE_URL = os.environ.get("DATABASE_URL")
 
+# After a write, keep this session's reads on the primary until replicas catch up
+READ_YOUR_WRITES_SECONDS = float(os.environ.get("READ_YOUR_WRITES_SECONDS", 10))
+
+def mark_write():
+    session["last_write_at"] = time.time()
+
+def use_replica():
+    """Reads may go to a replica only on GETs from sessions that haven't just written."""
+    if request.method not in ("GET", "HEAD"):
+        return False
+    return time.time() - session.get("last_write_at", 0) >= READ_YOUR_WRITES_SECONDS
+
+# PostgREST's own "can't reach the database" codes, plus gateway errors in front of it
+REPLICA_DOWN_CODES = ("PGRST000", "PGRST001", "PGRST002", "502", "503", "504")
+
+def replica_unavailable(error):
+    """True for errors that mean the replica itself is unhealthy, not that the query is wrong."""
+    if isinstance(error, httpx.TransportError):
+        return True
+    return isinstance(error, APIError) and str(error.code) in REPLICA_DOWN_CODES
+
+def pick_replica():
+    """The replica this request may read from, or None for the primary."""
+    return replicas.pick() if use_replica() else None
+
+def run_read(build, replica):
+    """
+    Run build(client) on `replica` (None means the primary), falling back to
+    the primary if the replica is down or unreachable.
+    Returns the result and the replica actually used.
+    """
+    if replica is None or not replicas.is_up(replica):
+        return build(supabase).execute(), None
+
+    try:
+        return build(replica.client).execute(), replica
+    except (httpx.TransportError, APIError) as e:
+        # A bad query would fail on the primary too, so only retry when the replica is at fault
+        if not replica_unavailable(e):
+            raise
+        replicas.mark_down(replica, e)
+        return build(supabase).execute(), None
+
+def read_query(build):
+    """
+    Run a read built by build(client) on a healthy replica when allowed,
+    falling back to the primary if none is available or the replica is unreachable.
+    """
+    res, _ = run_read(build, pick_replica())
+    return res
+
 def get_db_connection():
     conn = psycopg2.connect(
         DATABASE_URL,
@@ -94,6 +161,48 @@ def execute(sql, params=()):
     cur.close()
     conn.close()
 
+# Days of precomputed stats shown on the owner dashboard (same setting as reports.py)
+REPORT_DAYS = int(os.environ.get("REPORT_DAYS", 30))
+
+# Rows fetched per round trip by iter_rows()
+PAGE_SIZE = int(os.environ.get("PAGE_SIZE", 200))
+
+# Template events grouped into each streamed chunk
+STREAM_BUFFER_SIZE = int(os.environ.get("STREAM_BUFFER_SIZE", 32))
+
+def iter_rows(build, replica, key="id", desc=False):
+    """
+    Yield rows one page at a time, paging on the unique column `key`
+    (keyset, not offset, so inserts during the stream can't shift pages).
+    Every page is read from `replica`, or from the primary once it fails,
+    so one stream never mixes snapshots from differently lagged replicas.
+    """
+    last = None
+
+    def page(db):
+        query = build(db).order(key, desc=desc).limit(PAGE_SIZE)
+        if last is not None:
+            query = query.lt(key, last) if desc else query.gt(key, last)
+        return query
+
+    while True:
+        res, replica = run_read(page, replica)
+        yield from res.data
+        if len(res.data) < PAGE_SIZE:
+            return
+        last = res.data[-1][key]
+
+def stream_page(template_name, **context):
+    """
+    Render a template incrementally. The page head is sent before any
+    generator passed in the context is consumed, so list data is fetched
+    while the browser is already loading styles.
+    """
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(STREAM_BUFFER_SIZE)
+    return app.response_class(stream_with_context(stream), mimetype="text/html")
+
 def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -108,43 +217,41 @@ def allowed_file(filename):
 def home():
     sort_by = request.args.get("sort", "date")  # default is date
 
-    # Fetch all providers
-    res_providers = supabase.table("providers").select("*").execute()
-    providers = res_providers.data
-
-    # Fetch all ratings once (so we can always calculate avg_rating and num_reviews)
-    res_ratings = supabase.table("ratings").select("*").execute()
-    ratings = res_ratings.data
-
-    # Map provider_id -> list of ratings
-    ratings_map = {}
-    for r in ratings:
-        ratings_map.setdefault(r['provider_id'], []).append(r['rating'])
-
-    # Compute avg_rating and number of reviews for each provider
-    for p in providers:
-        p_ratings = ratings_map.get(p['id'], [])
-        if p_ratings:
-            p['avg_rating'] = round(sum(p_ratings) / len(p_ratings), 1)
-            p['num_reviews'] = len(p_ratings)
-        else:
-            p['avg_rating'] = 0
-            p['num_reviews'] = 0
+    providers = iter_providers(sort_by, pick_replica())
 
-    # Sorting
-    if sort_by == "rating":
-        providers_sorted = sorted(providers, key=lambda x: x['avg_rating'], reverse=True)
-    elif sort_by == "alphabetical":
-        providers_sorted = sorted(providers, key=lambda x: x['name'].lower())
-    else:  # default "date"
-        providers_sorted = sorted(providers, key=lambda x: x['created_at'], reverse=True)
+    return stream_page("index.html", providers=providers, sort_by=sort_by)
 
-    return render_template("index.html", providers=providers_sorted, sort_by=sort_by)
+def iter_providers(sort_by, replica):
+    # Average rating and review count per provider, aggregated in SQL (one row per rated provider)
+    summary = {
+        r['provider_id']: r
+        for r in iter_rows(lambda db: db.table("provider_rating_summary").select("*"), replica, key="provider_id")
+    }
+
+    def with_rating(p):
+        s = summary.get(p['id'])
+        p['avg_rating'] = float(s['avg_rating']) if s else 0
+        p['num_reviews'] = s['num_reviews'] if s else 0
+        log_event(LISTING_IMPRESSION, p['id'])
+        return p
+
+    if sort_by in ("rating", "alphabetical"):
+        # These orders depend on computed/normalised values, so sort in memory
+        providers = [with_rating(p) for p in iter_rows(lambda db: db.table("providers").select("*"), replica)]
+        if sort_by == "rating":
+            providers.sort(key=lambda x: x['avg_rating'], reverse=True)
+        else:
+            providers.sort(key=lambda x: x['name'].lower())
+        yield from providers
+    else:  # default "date": ids follow insertion order, so stream newest first by id
+        for p in iter_rows(lambda db: db.table("providers").select("*"), replica, desc=True):
+            yield with_rating(p)
 
 # -------------------------
 # REGISTER
 # -------------------------
 @app.route("/register", methods=["GET", "POST"])
+@limiter.limit(Limit("ip", 5, 3600))
 def register():
     if request.method == "POST":
         name = request.form["name"]
@@ -195,6 +302,7 @@ def register():
         }
 
         res = supabase.table("providers").insert(data).execute()
+        mark_write()
 
         provider = res.data[0]
         provider_id = provider["id"]
@@ -215,6 +323,10 @@ def register():
 # LOGIN
 # -------------------------
 @app.route("/login", methods=["GET", "POST"])
+@limiter.limit(
+    Limit("ip", 10, 60),
+    Limit("phone", 5, 900, key=by_phone, failures_only=True)
+)
 def login():
     if request.method == "POST":
         phone = request.form["phone"]
@@ -231,6 +343,7 @@ def login():
                 url_for("owner_dashboard", provider_id=provider["id"])
             )
         else:
+            limiter.record_failure()
             flash("Invalid phone number or password.", "error")
             return redirect("/login")
 
@@ -248,12 +361,17 @@ def owner_dashboard(provider_id):
         flash("Unauthorized access.", "error")
         return redirect("/login")
 
-    res = supabase.table("providers").select("*").eq("id", provider_id).execute()
+    res = read_query(lambda db: db.table("providers").select("*").eq("id", provider_id))
     provider = res.data[0] if res.data else None
 
-    res = supabase.table("ratings").select("*").eq("provider_id", provider_id).order("created_at", desc=True).execute()
+    res = read_query(lambda db: db.table("ratings").select("*").eq("provider_id", provider_id).order("created_at", desc=True))
     feedbacks = res.data
 
+    # Precomputed engagement stats (refreshed by reports.py)
+    since = (datetime.utcnow().date() - timedelta(days=REPORT_DAYS - 1)).isoformat()
+    res = read_query(lambda db: db.table("provider_daily_stats").select("*").eq("provider_id", provider_id).gte("day", since).order("day", desc=True))
+    daily_stats = res.data
+
     if not provider:
         return "Provider not found", 404
 
@@ -295,7 +413,7 @@ def owner_dashboard(provider_id):
             "profile_pic": unique_filename,
             "password": password_hash
         }).eq("id", provider_id).execute()
-    
+        mark_write()
 
         flash("Details updated successfully!", "success")
         return redirect(url_for("owner_dashboard", provider_id=provider_id))
@@ -318,11 +436,22 @@ def owner_dashboard(provider_id):
     services_labels = [service_map.get(s.strip(), s.strip()) for s in services_values]
     provider["services_display"] = ", ".join(services_labels)
 
+    stats_totals = {
+        "listing_impressions": sum(d["listing_impressions"] for d in daily_stats),
+        "listing_views": sum(d["listing_views"] for d in daily_stats),
+        "service_requests": sum(d["service_requests"] for d in daily_stats),
+        "reviews": sum(d["reviews"] for d in daily_stats)
+    }
+
     # Render template
     return render_template(
         "owner_dashboard.html",
         provider=provider,
-        feedbacks=feedbacks
+        feedbacks=feedbacks,
+        daily_stats=daily_stats,
+        stats_totals=stats_totals,
+        stats_days=REPORT_DAYS,
+        stats_refreshed_at=max((d["refreshed_at"] for d in daily_stats), default=None)
     )
 
 
@@ -330,9 +459,13 @@ def owner_dashboard(provider_id):
 # SERVICE PAGE
 # -------------------------
 @app.route("/service/<int:provider_id>", methods=["GET", "POST"])
+@limiter.limit(
+    Limit("ip", 3, 600),
+    Limit("provider", 5, 86400, key=by_ip_and_provider)
+)
 def service_page(provider_id):
 
-    res = supabase.table("providers").select("*").eq("id", provider_id).execute()
+    res = read_query(lambda db: db.table("providers").select("*").eq("id", provider_id))
     provider = res.data[0] if res.data else None
 
     # Convert services to comma-separated string
@@ -344,7 +477,7 @@ def service_page(provider_id):
         # It's a string, use as-is
         provider["services_str"] = services
 
-    res = supabase.table("ratings").select("*").eq("provider_id", provider_id).order("created_at", desc=True).limit(1).execute()
+    res = read_query(lambda db: db.table("ratings").select("*").eq("provider_id", provider_id).order("created_at", desc=True).limit(1))
     feedbacks = res.data
 
     if not provider:
@@ -361,10 +494,14 @@ def service_page(provider_id):
             "rating": rating,
             "comment": comment
         }).execute()
+        mark_write()
+        log_event(REVIEW_SUBMIT, provider_id, rating)
 
         flash("Thank you for your feedback!", "success")
         return redirect(url_for("service_page", provider_id=provider_id))
 
+    log_event(LISTING_VIEW, provider_id)
+
     return render_template(
         "service_page.html",
         provider=provider,
@@ -377,24 +514,23 @@ def service_page(provider_id):
 # -------------------------
 @app.route("/reviews/<int:provider_id>")
 def all_reviews(provider_id):
-    # Fetch all reviews
-    res = (
-        supabase.table("ratings")
-        .select("*")
-        .eq("provider_id", provider_id)
-        .order("created_at", desc=True)
-        .execute()
-    )
-    feedbacks = res.data
-
     # Fetch provider info
-    res2 = supabase.table("providers").select("*").eq("id", provider_id).execute()
+    res2 = read_query(lambda db: db.table("providers").select("*").eq("id", provider_id))
     provider = res2.data[0] if res2.data else None
 
     if not provider:
         return "Provider not found", 404
 
-    return render_template(
+    # Reviews are fetched page by page while the page streams, newest (highest id) first
+    feedbacks = iter_rows(
+        lambda db: db.table("ratings")
+        .select("*")
+        .eq("provider_id", provider_id),
+        pick_replica(),
+        desc=True
+    )
+
+    return stream_page(
         "all_reviews.html",
         provider=provider,
         feedbacks=feedbacks
@@ -405,9 +541,11 @@ def all_reviews(provider_id):
 # REQUEST SERVICE (WHATSAPP)
 # -------------------------
 @app.route("/request_service/<int:provider_id>")
+@limiter.limit(
+    Limit("ip", 5, 60, methods=("GET",)),
+    Limit("provider", 10, 3600, key=by_ip_and_provider, methods=("GET",))
+)
 def request_service(provider_id):
-    print("Request Service Route Hit", provider_id)
-
     res = supabase.table("providers").select("name, phone").eq("id", provider_id).execute()
     provider = res.data[0] if res.data else None
 
@@ -417,6 +555,7 @@ def request_service(provider_id):
 
     # ✅ Token generation stays unchanged
     token = generate_review_token(provider_id)
+    log_event(SERVICE_REQUEST, provider_id)
 
     review_link = url_for("leave_review", token=token, _external=True)
 
@@ -439,6 +578,7 @@ def request_service(provider_id):
 # REVIEW PAGE
 # -------------------------
 @app.route("/review/<token>", methods=["GET", "POST"])
+@limiter.limit(Limit("ip", 5, 600))
 def leave_review(token):
     res = supabase.table("review_tokens") \
     .select("*") \
@@ -465,6 +605,8 @@ def leave_review(token):
             "rating": rating,
             "comment": comment
         }).execute()
+        mark_write()
+        log_event(REVIEW_SUBMIT, provider_id, rating)
 
         # Delete token after use
         supabase.table("review_tokens").delete().eq("token", token).execute()
@@ -487,6 +629,10 @@ def logout():
 # FORGOT PASSWORD
 # -------------------------
 @app.route("/forgot-password", methods=["GET", "POST"])
+@limiter.limit(
+    Limit("ip", 5, 900),
+    Limit("phone", 3, 3600, key=by_phone, failures_only=True)
+)
 def forgot_password():
     reset_link = None
 
@@ -512,6 +658,8 @@ def forgot_password():
             }).execute()
 
             reset_link = url_for("reset_password", token=raw_token, _external=True)
+        else:
+            limiter.record_failure()
 
         return render_template("forgot_password.html", reset_link=reset_link)
 
@@ -522,6 +670,8 @@ def forgot_password():
 # RESET PASSWORD
 # -------------------------
 @app.route("/reset-password/<token>", methods=["GET", "POST"])
+# Every hit runs the KDF over all live reset tokens, GET included
+@limiter.limit(Limit("ip", 10, 900, methods=("GET", "POST")))
 def reset_password(token):
     # Fetch all non-expired reset tokens
     resets = supabase.table("password_resets").select("*").filter("expires_at", "gt", datetime.utcnow()).execute().data
@@ -554,6 +704,7 @@ def reset_password(token):
         supabase.table("providers").update({
             "password": password_hash
         }).eq("id", match["provider_id"]).execute()
+        mark_write()
 
         # Delete used reset token
         supabase.table("password_resets").delete().eq("id", match["id"]).execute()
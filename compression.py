@@ -0,0 +1,128 @@
+import os
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+# =========================
+# CONFIGURATION
+# =========================
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 500))        # bytes; smaller bodies go out as-is
+COMPRESS_GZIP_LEVEL = int(os.environ.get("COMPRESS_GZIP_LEVEL", 6))
+COMPRESS_BROTLI_QUALITY = int(os.environ.get("COMPRESS_BROTLI_QUALITY", 5))
+
+COMPRESSIBLE_MIMETYPES = {
+    "text/html",
+    "text/css",
+    "text/plain",
+    "text/xml",
+    "application/json",
+    "application/javascript",
+    "text/javascript",
+    "image/svg+xml"
+}
+
+# =========================
+# COMPRESSORS
+# =========================
+class GzipStream:
+    def __init__(self):
+        # wbits=31 -> gzip header/trailer
+        self._obj = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def chunk(self, data):
+        # Sync flush so every chunk reaches the browser right away
+        return self._obj.compress(data) + self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._obj.flush()
+
+
+class BrotliStream:
+    def __init__(self):
+        self._obj = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+
+    def chunk(self, data):
+        return self._obj.process(data) + self._obj.flush()
+
+    def finish(self):
+        return self._obj.finish()
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=COMPRESS_BROTLI_QUALITY)
+    obj = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 31)
+    return obj.compress(data) + obj.flush()
+
+
+def _compress_chunks(chunks, stream):
+    try:
+        for data in chunks:
+            if isinstance(data, str):
+                data = data.encode("utf-8")
+            out = stream.chunk(data)
+            if out:
+                yield out
+        yield stream.finish()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+# =========================
+# FLASK EXTENSION
+# =========================
+class Compress:
+    """gzip/brotli response compression, including streamed responses."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.after_request(self.after_request)
+
+    def choose_encoding(self):
+        accepted = request.accept_encodings
+        if brotli is not None and accepted["br"] > 0:
+            return "br"
+        if accepted["gzip"] > 0:
+            return "gzip"
+        return None
+
+    def after_request(self, response):
+        response.vary.add("Accept-Encoding")
+
+        if (
+            response.status_code != 200
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+        ):
+            return response
+
+        encoding = self.choose_encoding()
+        if encoding is None:
+            return response
+
+        if response.is_streamed and not response.direct_passthrough:
+            # Length is unknown up front, so streamed pages are always compressed
+            stream = BrotliStream() if encoding == "br" else GzipStream()
+            response.response = _compress_chunks(response.response, stream)
+            response.headers.pop("Content-Length", None)
+        else:
+            response.direct_passthrough = False
+            data = response.get_data()
+            if len(data) < COMPRESS_MIN_SIZE:
+                return response
+            response.set_data(compress(data, encoding))
+
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+
+        response.headers["Content-Encoding"] = encoding
+        return response
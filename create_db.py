@@ -32,6 +32,10 @@ def table_exists(cursor, table):
     """, (table,))
     return cursor.fetchone()[0]
 
+def role_exists(cursor, role):
+    cursor.execute("SELECT EXISTS (SELECT FROM pg_roles WHERE rolname = %s)", (role,))
+    return cursor.fetchone()[0]
+
 # =========================
 # MIGRATION
 # =========================
@@ -103,6 +107,145 @@ def migrate():
         )
         """)
 
+    # =========================
+    # EVENTS (APPEND-ONLY ENGAGEMENT LOG)
+    # =========================
+    if not table_exists(cur, "events"):
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS events (
+            id BIGSERIAL PRIMARY KEY,
+            provider_id INTEGER NOT NULL REFERENCES providers(id) ON DELETE CASCADE,
+            event_type VARCHAR(32) NOT NULL,
+            rating INTEGER CHECK (rating BETWEEN 1 AND 5),
+            occurrences INTEGER NOT NULL DEFAULT 1,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS events_created_at_idx ON events (created_at)")
+
+    # =========================
+    # PROVIDER DAILY STATS (PRECOMPUTED BY reports.py)
+    # =========================
+    if not table_exists(cur, "provider_daily_stats"):
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS provider_daily_stats (
+            provider_id INTEGER NOT NULL REFERENCES providers(id) ON DELETE CASCADE,
+            day DATE NOT NULL,
+            listing_impressions INTEGER NOT NULL DEFAULT 0,
+            listing_views INTEGER NOT NULL DEFAULT 0,
+            service_requests INTEGER NOT NULL DEFAULT 0,
+            reviews INTEGER NOT NULL DEFAULT 0,
+            avg_rating NUMERIC(4,3),
+            rolling_avg_rating NUMERIC(4,3),
+            refreshed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (provider_id, day)
+        )
+        """)
+
+    # =========================
+    # RATING SUMMARY (ONE ROW PER RATED PROVIDER, READ BY THE HOME PAGE)
+    # =========================
+    cur.execute("""
+    CREATE OR REPLACE VIEW provider_rating_summary AS
+        SELECT provider_id,
+               ROUND(AVG(rating), 1) AS avg_rating,
+               COUNT(*) AS num_reviews
+        FROM ratings
+        GROUP BY provider_id
+    """)
+
+    # =========================
+    # REPLICA LAG PROBE (CALLED VIA RPC BY supabase_client.py)
+    # =========================
+    cur.execute("""
+    CREATE OR REPLACE FUNCTION replica_lag_seconds()
+    RETURNS DOUBLE PRECISION AS $$
+        SELECT CASE
+            WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+        END
+    $$ LANGUAGE sql STABLE
+    """)
+
+    # =========================
+    # RATE LIMIT BUCKETS (SHARED STORE FOR rate_limit.py)
+    # =========================
+    if not table_exists(cur, "rate_limit_buckets"):
+        cur.execute("""
+        CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_buckets (
+            key TEXT PRIMARY KEY,
+            tokens DOUBLE PRECISION NOT NULL,
+            capacity DOUBLE PRECISION NOT NULL,
+            refill_per_sec DOUBLE PRECISION NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL
+        )
+        """)
+
+    # Replaced by the version with a cost argument below; two overloads would make the RPC ambiguous
+    cur.execute("DROP FUNCTION IF EXISTS take_rate_token(TEXT, DOUBLE PRECISION, DOUBLE PRECISION)")
+
+    # Takes `cost` tokens atomically (0 only checks); returns 0 if allowed, else seconds to wait.
+    # Runs with the caller's rights and is only callable with the service-role key.
+    cur.execute("""
+    CREATE OR REPLACE FUNCTION take_rate_token(
+        bucket_key TEXT,
+        capacity DOUBLE PRECISION,
+        refill_per_sec DOUBLE PRECISION,
+        cost DOUBLE PRECISION DEFAULT 1
+    )
+    RETURNS DOUBLE PRECISION
+    SET search_path = public
+    AS $$
+    DECLARE
+        current_tokens DOUBLE PRECISION;
+        stamp TIMESTAMPTZ;
+        now_ts TIMESTAMPTZ := clock_timestamp();
+    BEGIN
+        IF capacity < 1 OR refill_per_sec <= 0 OR cost < 0 THEN
+            RAISE EXCEPTION 'take_rate_token: capacity must be >= 1, refill_per_sec > 0 and cost >= 0';
+        END IF;
+
+        -- Now and then, sweep buckets that have refilled completely; they're equivalent to no row
+        IF random() < 0.01 THEN
+            DELETE FROM rate_limit_buckets b
+            WHERE b.tokens + EXTRACT(EPOCH FROM now_ts - b.updated_at) * b.refill_per_sec >= b.capacity;
+        END IF;
+
+        INSERT INTO rate_limit_buckets (key, tokens, capacity, refill_per_sec, updated_at)
+        VALUES (bucket_key, capacity, capacity, refill_per_sec, now_ts)
+        ON CONFLICT (key) DO UPDATE
+        SET capacity = EXCLUDED.capacity, refill_per_sec = EXCLUDED.refill_per_sec;
+
+        SELECT tokens, updated_at INTO current_tokens, stamp
+        FROM rate_limit_buckets
+        WHERE key = bucket_key
+        FOR UPDATE;
+
+        current_tokens := LEAST(capacity, current_tokens + EXTRACT(EPOCH FROM now_ts - stamp) * refill_per_sec);
+
+        IF current_tokens >= 1 THEN
+            UPDATE rate_limit_buckets SET tokens = current_tokens - cost, updated_at = now_ts WHERE key = bucket_key;
+            RETURN 0;
+        END IF;
+
+        UPDATE rate_limit_buckets SET tokens = current_tokens, updated_at = now_ts WHERE key = bucket_key;
+        RETURN (1 - current_tokens) / refill_per_sec;
+    END
+    $$ LANGUAGE plpgsql
+    """)
+
+    cur.execute("REVOKE EXECUTE ON FUNCTION take_rate_token(TEXT, DOUBLE PRECISION, DOUBLE PRECISION, DOUBLE PRECISION) FROM PUBLIC")
+
+    # Supabase roles; a plain Postgres database doesn't have them
+    if all(role_exists(cur, role) for role in ("anon", "authenticated", "service_role")):
+        cur.execute("""
+        REVOKE EXECUTE ON FUNCTION take_rate_token(TEXT, DOUBLE PRECISION, DOUBLE PRECISION, DOUBLE PRECISION)
+        FROM anon, authenticated
+        """)
+        cur.execute("GRANT EXECUTE ON FUNCTION take_rate_token(TEXT, DOUBLE PRECISION, DOUBLE PRECISION, DOUBLE PRECISION) TO service_role")
+        cur.execute("REVOKE ALL ON TABLE rate_limit_buckets FROM anon, authenticated")
+
     conn.commit()
     cur.close()
     conn.close()
@@ -0,0 +1,128 @@
+import os
+import atexit
+import threading
+from datetime import datetime
+
+from supabase_client import supabase
+
+# =========================
+# CONFIGURATION
+# =========================
+EVENT_BATCH_SIZE = int(os.environ.get("EVENT_BATCH_SIZE", 50))
+EVENT_FLUSH_INTERVAL = float(os.environ.get("EVENT_FLUSH_INTERVAL", 5))
+EVENT_BUFFER_LIMIT = int(os.environ.get("EVENT_BUFFER_LIMIT", 5000))
+EVENT_MAX_ATTEMPTS = int(os.environ.get("EVENT_MAX_ATTEMPTS", 3))
+
+LISTING_IMPRESSION = "listing_impression"  # card shown on the home page
+LISTING_VIEW = "listing_view"              # service page opened
+SERVICE_REQUEST = "service_request"
+REVIEW_SUBMIT = "review_submit"
+
+EVENT_TYPES = (LISTING_IMPRESSION, LISTING_VIEW, SERVICE_REQUEST, REVIEW_SUBMIT)
+
+# =========================
+# IN-PROCESS BUFFER
+# =========================
+_buffer = []
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_flusher = None
+_retry = None  # (batch, attempts) that failed on the last flush
+_counted = {}  # (event_type, provider_id, day) -> buffered row still taking increments
+
+
+def log_event(event_type, provider_id, rating=None):
+    """
+    Queue an engagement event. Never touches the database on the request path.
+    Unrated events of the same type, provider and day share one row (its occurrences),
+    so a home page view adds to per-provider counters instead of one row per card.
+    """
+    if event_type not in EVENT_TYPES:
+        raise ValueError(f"Unknown event type: {event_type}")
+
+    # Stamp now, not at flush time, so batching doesn't shift events across days
+    created_at = datetime.utcnow().isoformat()
+    key = (event_type, provider_id, created_at[:10])
+
+    with _lock:
+        if rating is None and key in _counted:
+            _counted[key]["occurrences"] += 1
+            return
+
+        event = {
+            "event_type": event_type,
+            "provider_id": provider_id,
+            "rating": rating,
+            "occurrences": 1,
+            "created_at": created_at
+        }
+        _buffer.append(event)
+        if rating is None:
+            _counted[key] = event
+
+        if len(_buffer) > EVENT_BUFFER_LIMIT:
+            # Backend unreachable for a while: drop the oldest rather than grow forever
+            dropped = _buffer[:len(_buffer) - EVENT_BUFFER_LIMIT]
+            del _buffer[:len(dropped)]
+            for old in dropped:
+                _counted.pop((old["event_type"], old["provider_id"], old["created_at"][:10]), None)
+        full = len(_buffer) >= EVENT_BATCH_SIZE
+
+    _ensure_flusher()
+    if full:
+        _wakeup.set()
+
+
+def flush():
+    """
+    Write everything buffered so far to the events table in batches.
+    A batch that keeps failing is dropped after EVENT_MAX_ATTEMPTS flushes
+    so a single bad row can't hold up everything logged after it.
+    """
+    global _retry
+
+    with _lock:
+        pending = _buffer[:]
+        _buffer.clear()
+        _counted.clear()
+        retry, _retry = _retry, None
+
+    batches = [(pending[i:i + EVENT_BATCH_SIZE], 0) for i in range(0, len(pending), EVENT_BATCH_SIZE)]
+    if retry:
+        batches.insert(0, retry)
+
+    for i, (batch, attempts) in enumerate(batches):
+        try:
+            supabase.table("events").insert(batch).execute()
+        except Exception as e:
+            attempts += 1
+            if attempts >= EVENT_MAX_ATTEMPTS:
+                print(f"Dropping {len(batch)} events after {attempts} failed flushes:", e)
+                continue
+
+            print("Failed to flush events:", e)
+            # Retry this batch first next time; the rest goes back in front of anything logged meanwhile
+            with _lock:
+                _retry = (batch, attempts)
+                _buffer[:0] = [event for rest, _ in batches[i + 1:] for event in rest]
+            return
+
+
+def _run_flusher():
+    while True:
+        _wakeup.wait(EVENT_FLUSH_INTERVAL)
+        _wakeup.clear()
+        flush()
+
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is not None and _flusher.is_alive():
+        return
+    with _lock:
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = threading.Thread(target=_run_flusher, name="event-flusher", daemon=True)
+            _flusher.start()
+
+
+atexit.register(flush)
@@ -0,0 +1,211 @@
+import os
+import math
+import time
+import threading
+from collections import Counter
+from functools import wraps
+
+from flask import request, g
+
+from supabase_client import supabase_service
+
+# =========================
+# CONFIGURATION
+# =========================
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "1") != "0"
+RATE_LIMIT_STORE = os.environ.get("RATE_LIMIT_STORE", "memory")    # "memory" or "database"
+MEMORY_STORE_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", 100000))
+RATE_LIMIT_LOG_INTERVAL = float(os.environ.get("RATE_LIMIT_LOG_INTERVAL", 60))  # seconds between rejection summaries
+
+# =========================
+# KEY FUNCTIONS
+# =========================
+def by_ip():
+    # The real client address once ProxyFix (see TRUSTED_PROXY_HOPS in app.py) has run
+    return request.remote_addr
+
+def by_ip_and_provider():
+    # Per client *and* provider: one client can't use up a provider's allowance for everyone
+    provider_id = (request.view_args or {}).get("provider_id")
+    return f"{request.remote_addr}:{provider_id}" if provider_id is not None else None
+
+def by_phone():
+    phone = request.form.get("phone")
+    return phone.replace(" ", "") if phone else None
+
+# =========================
+# POLICY
+# =========================
+class Limit:
+    """
+    A token bucket: `rate` requests per `per` seconds, with bursts of up to `burst`.
+    With failures_only=True a request is only refused once the bucket is empty,
+    and only requests the view reports via limiter.record_failure() use it up.
+    """
+
+    def __init__(self, name, rate, per, key=by_ip, burst=None, methods=("POST",), failures_only=False):
+        self.name = name
+        self.capacity = float(burst or rate)
+        self.refill_per_sec = rate / per
+        self.key = key
+        self.methods = methods
+        self.failures_only = failures_only
+
+# =========================
+# STORES
+# =========================
+class MemoryStore:
+    """Per-process buckets. Limits only hold within one worker."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, refill_per_sec, cost=1):
+        """
+        Take `cost` tokens (0 just checks). Returns 0 if at least one token
+        was available, else seconds until one is.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, stamp = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - stamp) * refill_per_sec)
+
+            if tokens >= 1:
+                self._buckets[key] = (tokens - cost, now)
+                retry_after = 0
+            else:
+                self._buckets[key] = (tokens, now)
+                retry_after = (1 - tokens) / refill_per_sec
+
+            if len(self._buckets) > MEMORY_STORE_MAX_KEYS:
+                self._prune(now)
+
+        return retry_after
+
+    def _prune(self, now):
+        # Oldest first; anything idle for an hour has almost certainly refilled
+        for key, (tokens, stamp) in sorted(self._buckets.items(), key=lambda kv: kv[1][1]):
+            if len(self._buckets) <= MEMORY_STORE_MAX_KEYS // 2 and now - stamp < 3600:
+                break
+            del self._buckets[key]
+
+
+class DatabaseStore:
+    """
+    Buckets shared by every worker, kept in the rate_limit_buckets table and
+    updated atomically by the take_rate_token() SQL function.
+    Falls back to per-process buckets if the database can't be reached.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.fallback = MemoryStore()
+
+    def take(self, key, capacity, refill_per_sec, cost=1):
+        try:
+            res = self.client.rpc("take_rate_token", {
+                "bucket_key": key,
+                "capacity": capacity,
+                "refill_per_sec": refill_per_sec,
+                "cost": cost
+            }).execute()
+            return float(res.data or 0)
+        except Exception as e:
+            print("Rate limit store unavailable:", e)
+            return self.fallback.take(key, capacity, refill_per_sec, cost)
+
+# =========================
+# FLASK EXTENSION
+# =========================
+class RateLimiter:
+    def __init__(self, app=None, store=None):
+        self.store = store
+        self._rejected = Counter()  # (endpoint, limit name) -> rejections since startup
+        self._window = Counter()    # same, since the last summary line
+        self._logged_at = 0.0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if self.store is None:
+            if RATE_LIMIT_STORE == "database":
+                if supabase_service is None:
+                    raise Exception("RATE_LIMIT_STORE=database needs SUPABASE_SERVICE_ROLE_KEY set!")
+                self.store = DatabaseStore(supabase_service)
+            else:
+                self.store = MemoryStore()
+
+    def limit(self, *limits):
+        """Apply token-bucket limits to a view. Rejected requests get a 429 with Retry-After."""
+        def decorator(view):
+            @wraps(view)
+            def wrapped(*args, **kwargs):
+                if not RATE_LIMIT_ENABLED:
+                    return view(*args, **kwargs)
+
+                rejected = self.check(view.__name__, limits)
+                if rejected:
+                    return rejected
+
+                response = view(*args, **kwargs)
+                if g.get("rate_limit_failed"):
+                    self.charge_failure(view.__name__, limits)
+                return response
+            return wrapped
+        return decorator
+
+    def record_failure(self):
+        """Called by a view when the request failed (wrong password, unknown account, ...)."""
+        g.rate_limit_failed = True
+
+    def check(self, endpoint, limits):
+        for limit in limits:
+            if request.method not in limit.methods:
+                continue
+
+            key = limit.key()
+            if key is None:
+                continue
+
+            retry_after = self.store.take(
+                f"{endpoint}:{limit.name}:{key}",
+                limit.capacity,
+                limit.refill_per_sec,
+                cost=0 if limit.failures_only else 1
+            )
+            if retry_after > 0:
+                self._count_rejection(endpoint, limit.name)
+                return (
+                    "Too many requests. Please try again later.",
+                    429,
+                    {"Retry-After": str(math.ceil(retry_after))}
+                )
+
+        return None
+
+    def charge_failure(self, endpoint, limits):
+        for limit in limits:
+            if not limit.failures_only or request.method not in limit.methods:
+                continue
+
+            key = limit.key()
+            if key is not None:
+                self.store.take(f"{endpoint}:{limit.name}:{key}", limit.capacity, limit.refill_per_sec)
+
+    def _count_rejection(self, endpoint, name):
+        # One summary line per interval instead of a line per rejected request
+        now = time.monotonic()
+        with self._lock:
+            self._rejected[(endpoint, name)] += 1
+            self._window[(endpoint, name)] += 1
+            if now - self._logged_at < RATE_LIMIT_LOG_INTERVAL:
+                return
+            window, self._window = self._window, Counter()
+            totals = dict(self._rejected)
+            self._logged_at = now
+
+        print("Rate limit rejections since last report:", ", ".join(
+            f"{e} ({n}): {c} ({totals[(e, n)]} total)" for (e, n), c in sorted(window.items())
+        ))
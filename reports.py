@@ -0,0 +1,149 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from supabase_client import supabase
+from events import LISTING_IMPRESSION, LISTING_VIEW, SERVICE_REQUEST, REVIEW_SUBMIT
+
+# =========================
+# CONFIGURATION
+# =========================
+REPORT_DAYS = int(os.environ.get("REPORT_DAYS", 30))
+RATING_WINDOW_DAYS = 7
+PAGE_SIZE = 1000
+
+FUNNEL_COLUMNS = {
+    LISTING_IMPRESSION: "listing_impressions",
+    LISTING_VIEW: "listing_views",
+    SERVICE_REQUEST: "service_requests",
+    REVIEW_SUBMIT: "reviews"
+}
+
+# =========================
+# LOAD EVENTS
+# =========================
+def load_events(since):
+    """Fetch events newer than `since` as a DataFrame, paging on id (keyset, not offset)."""
+    rows = []
+    last_id = 0
+    while True:
+        res = (
+            supabase.table("events")
+            .select("id, provider_id, event_type, rating, occurrences, created_at")
+            .gte("created_at", since.isoformat())
+            .gt("id", last_id)
+            .order("id")
+            .limit(PAGE_SIZE)
+            .execute()
+        )
+        rows.extend(res.data)
+        if len(res.data) < PAGE_SIZE:
+            break
+        last_id = res.data[-1]["id"]
+
+    return pd.DataFrame(rows, columns=["id", "provider_id", "event_type", "rating", "occurrences", "created_at"])
+
+# =========================
+# AGGREGATION
+# =========================
+def build_daily_stats(events, start_day, end_day):
+    """
+    Turn raw events into one row per (provider_id, day) with funnel counts,
+    the day's average rating and a trailing 7-day average.
+
+    No conversion rates: requests come from both home cards and service
+    pages, and reviews arrive days after the request they follow.
+    """
+    if events.empty:
+        return pd.DataFrame()
+
+    events = events.copy()
+    events["day"] = pd.to_datetime(events["created_at"], utc=True, format="ISO8601").dt.tz_localize(None).dt.normalize()
+    events["rating"] = pd.to_numeric(events["rating"], errors="coerce")
+
+    days = pd.date_range(start_day, end_day, freq="D")
+    index = pd.MultiIndex.from_product(
+        [np.sort(events["provider_id"].unique()), days],
+        names=["provider_id", "day"]
+    )
+
+    # Funnel counts: one column per event type
+    counts = (
+        events.groupby(["provider_id", "day", "event_type"])["occurrences"].sum()
+        .unstack("event_type", fill_value=0)
+        .reindex(columns=list(FUNNEL_COLUMNS), fill_value=0)
+        .rename(columns=FUNNEL_COLUMNS)
+        .reindex(index, fill_value=0)
+    )
+
+    # Daily rating sums/counts, laid out as day x provider matrices
+    reviews = events[events["event_type"] == REVIEW_SUBMIT].dropna(subset=["rating"])
+    rating_sum = reviews.pivot_table(index="day", columns="provider_id", values="rating", aggfunc="sum")
+    rating_cnt = reviews.pivot_table(index="day", columns="provider_id", values="rating", aggfunc="count")
+    providers = index.levels[0]
+    rating_sum = rating_sum.reindex(index=days, columns=providers, fill_value=0).fillna(0)
+    rating_cnt = rating_cnt.reindex(index=days, columns=providers, fill_value=0).fillna(0)
+
+    window_sum = rating_sum.rolling(RATING_WINDOW_DAYS, min_periods=1).sum()
+    window_cnt = rating_cnt.rolling(RATING_WINDOW_DAYS, min_periods=1).sum()
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        avg_rating = rating_sum.to_numpy() / rating_cnt.to_numpy()
+        rolling_avg = window_sum.to_numpy() / window_cnt.to_numpy()
+
+    # Matrices are day x provider; the stats index is provider-major
+    stats = counts
+    stats["avg_rating"] = avg_rating.T.ravel()
+    stats["rolling_avg_rating"] = rolling_avg.T.ravel()
+
+    stats[["avg_rating", "rolling_avg_rating"]] = stats[["avg_rating", "rolling_avg_rating"]].round(3)
+
+    return stats.reset_index()
+
+# =========================
+# STORE
+# =========================
+def save_daily_stats(stats):
+    if stats.empty:
+        return 0
+
+    stats = stats.copy()
+    stats["day"] = stats["day"].dt.date.astype(str)
+    stats["refreshed_at"] = datetime.utcnow().isoformat()
+    stats = stats.astype(object).where(stats.notna(), None)
+    rows = stats.to_dict("records")
+
+    for start in range(0, len(rows), PAGE_SIZE):
+        supabase.table("provider_daily_stats").upsert(
+            rows[start:start + PAGE_SIZE],
+            on_conflict="provider_id,day"
+        ).execute()
+
+    return len(rows)
+
+
+def refresh_reports(days=REPORT_DAYS):
+    """Recompute the last `days` days of per-provider stats."""
+    end_day = datetime.utcnow().date()
+    start_day = end_day - timedelta(days=days - 1)
+
+    # Load a few extra days so the trailing rating window is full on day one
+    since = datetime.combine(start_day - timedelta(days=RATING_WINDOW_DAYS - 1), datetime.min.time())
+    events = load_events(since)
+
+    stats = build_daily_stats(events, since.date(), end_day)
+    if not stats.empty:
+        stats = stats[stats["day"] >= pd.Timestamp(start_day)]
+
+    return save_daily_stats(stats)
+
+# =========================
+# RUN REPORTS
+# =========================
+if __name__ == "__main__":
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else REPORT_DAYS
+    count = refresh_reports(days)
+    print(f"✔ Refreshed {count} provider/day rows.")
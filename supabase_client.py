@@ -1,7 +1,96 @@
-from supabase import create_client
+from supabase import create_client, ClientOptions
 import os
+import time
+import threading
 
+SUPABASE_KEY = os.getenv("SUPABASE_ANON_KEY")
+SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+
+# Primary: every write, and any read that must see the latest data
 supabase = create_client(
     os.getenv("SUPABASE_URL"),
-    os.getenv("SUPABASE_ANON_KEY")
+    SUPABASE_KEY
+)
+
+# Server-side only: for RPCs revoked from the anon role (never send this key to a browser)
+supabase_service = (
+    create_client(os.getenv("SUPABASE_URL"), SUPABASE_SERVICE_ROLE_KEY)
+    if SUPABASE_SERVICE_ROLE_KEY else None
 )
+
+# =========================
+# READ REPLICAS
+# =========================
+REPLICA_URLS = [u.strip() for u in os.getenv("SUPABASE_REPLICA_URLS", "").split(",") if u.strip()]
+MAX_REPLICA_LAG = float(os.getenv("MAX_REPLICA_LAG", 5))               # seconds
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", 10))  # seconds between lag probes
+REPLICA_RETRY_AFTER = float(os.getenv("REPLICA_RETRY_AFTER", 30))        # seconds a failed replica sits out
+REPLICA_TIMEOUT = float(os.getenv("REPLICA_TIMEOUT", 3))                 # seconds before a replica request gives up
+
+
+class Replica:
+    def __init__(self, url):
+        self.url = url
+        # Short timeout: a silent replica should fail over quickly, not hold a page for minutes
+        self.client = create_client(url, SUPABASE_KEY, options=ClientOptions(postgrest_client_timeout=REPLICA_TIMEOUT))
+        self.lag = float("inf")  # untrusted until the first probe
+        self.checked_at = 0.0
+        self.down_until = 0.0
+        self.probing = False
+
+
+class ReplicaPool:
+    """Round-robin over replicas, skipping ones that are down or lagging too far behind."""
+
+    def __init__(self, urls):
+        self.replicas = [Replica(url) for url in urls]
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def pick(self):
+        """Return a usable replica, or None if the primary should serve the read."""
+        for _ in range(len(self.replicas)):
+            now = time.monotonic()
+            with self._lock:
+                replica = self.replicas[self._next]
+                self._next = (self._next + 1) % len(self.replicas)
+
+                # Only one thread probes a replica; the rest go by its last known lag
+                probe = (
+                    now >= replica.down_until
+                    and not replica.probing
+                    and now - replica.checked_at >= REPLICA_CHECK_INTERVAL
+                )
+                if probe:
+                    replica.probing = True
+
+            if probe:
+                try:
+                    self._check(replica, now)
+                finally:
+                    replica.probing = False
+
+            if time.monotonic() >= replica.down_until and replica.lag <= MAX_REPLICA_LAG:
+                return replica
+
+        return None
+
+    def is_up(self, replica):
+        return time.monotonic() >= replica.down_until
+
+    def mark_down(self, replica, error=None):
+        print(f"Replica {replica.url} unavailable:", error)
+        replica.down_until = time.monotonic() + REPLICA_RETRY_AFTER
+        replica.lag = float("inf")  # probe lag again before trusting it
+        replica.checked_at = 0.0
+
+    def _check(self, replica, now):
+        replica.checked_at = now
+        try:
+            res = replica.client.rpc("replica_lag_seconds").execute()
+            replica.lag = float(res.data or 0)
+        except Exception as e:
+            self.mark_down(replica, e)
+
+
+replicas = ReplicaPool(REPLICA_URLS)